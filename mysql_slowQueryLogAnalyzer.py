@@ -7,70 +7,145 @@
 
 import re
 import json
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from datetime import datetime
 import argparse
+import functools
+import mmap
+import multiprocessing
 import os
+import stat
 import xlsxwriter
 
+# 可选依赖 google-re2，DFA 引擎线性时间匹配，安装后用于提取表名
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# 可选依赖 orjson，安装后用于输出 JSON 报告，比标准库 json 快得多
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 子进程解析的段首还没遇到 use 语句时使用的占位库名，合并时替换为上一段最后的数据库
+_INHERIT_DB = '\0inherit'
+
+# 报告中的一行；db 为排序后的库列表，db_cell、db_md 为 Excel、Markdown 中显示的 db 列，remark 为处理方式
+_ReportRow = namedtuple('_ReportRow', ['table', 'count', 'total_time', 'avg_time', 'max_time',
+                                       'db', 'db_cell', 'db_md', 'sql', 'remark'])
+
+
+def _is_regular_file(filename):
+    """是否为普通文件，管道、FIFO 等无法 mmap，也无法按字节范围切分"""
+    return stat.S_ISREG(os.stat(filename).st_mode)
+
+
+def _iter_lines(filename, start=0, end=None):
+    """逐行返回 [start, end) 字节范围内的原始 bytes，不做解码
+
+    普通文件用 mmap 读取；管道等非普通文件按顺序读取整个输入，忽略 start、end
+    """
+    if not _is_regular_file(filename):
+        with open(filename, 'rb', buffering=1 << 20) as f:
+            yield from f
+        return
+    if os.path.getsize(filename) == 0:
+        return
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # 提示内核顺序读，加大预读，冷缓存时读取更快
+        if hasattr(mm, 'madvise'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        if end is None:
+            end = len(mm)
+        mm.seek(start)
+        readline = mm.readline
+        while mm.tell() < end:
+            yield readline()
+
+
+def _parse_chunk(args):
+    """在子进程中解析一段日志，返回该段的统计结果"""
+    filename, start, end = args
+    analyzer = _ChunkAnalyzer()
+    analyzer._parse_lines(_iter_lines(filename, start, end))
+    # defaultdict 的 lambda 无法 pickle，转成普通 dict 返回；只返回聚合结果，不返回逐条查询
+    db_stats = {db_name: {'query_count': stats['query_count'],
+                          'tables': dict(stats['tables'])}
+                for db_name, stats in analyzer.db_stats.items()}
+    return analyzer.sql_stats, dict(analyzer.sql_dbs), db_stats, analyzer.current_db
+
 
 class SlowQueryLogAnalyzer:
+    # 提取表名的正则，类加载时编译一次
+    # 匹配 SELECT 的 FROM/JOIN、INSERT INTO、UPDATE 中的表名，一次扫描完成
+    # 安装了 re2 时优先使用，接口与 re 一致
+    _TABLE_RE = (re2 or re).compile(r'(?i)\b(?:FROM|JOIN|INSERT\s+INTO|UPDATE)\s+([^\s,;()]+)')
+    # 正则的关键字，不包含任何一个时可直接跳过正则
+    _TABLE_KEYWORDS = ('from', 'join', 'insert', 'update')
+    # User@Host、Query_time 头的正则
+    _USER_HOST_RE = re.compile(rb'# User@Host:\s+(\w+)\[.*\]\s+@\s+\[(.*?)\]')
+    _QUERY_TIME_RE = re.compile(
+        rb'# Query_time:\s+([\d.]+)\s+Lock_time:\s+([\d.]+)\s+Rows_sent:\s+(\d+)\s+Rows_examined:\s+(\d+)')
+    # 小于该大小的日志直接单进程解析，避免进程池的开销
+    _PARALLEL_MIN_SIZE = 32 << 20
+    # 是否在 db_stats 中保留每条查询，多进程解析时不保留，避免逐条查询在进程间序列化
+    _KEEP_QUERIES = True
+
     def __init__(self):
         self.queries = []
         self.current_db = None
+        # 按 (表, SQL哈希) 聚合的查询统计
+        self.sql_stats = {}
+        # 每个表涉及的数据库
+        self.table_dbs = defaultdict(set)
         # 按数据库分组的查询统计
-        self.tables = {}
         self.db_stats = defaultdict(lambda: {
             'query_count': 0,
             'queries': [],
             'tables': defaultdict(int)  # 记录每个表的查询次数
         })
 
-    def parse_log_file(self, filename):
-        """解析MySQL慢查询日志文件"""
-        current_query = {}
+    def parse_log_file(self, filename, jobs=1):
+        """解析MySQL慢查询日志文件，jobs 大于 1 且文件较大时多进程解析
+
+        多进程解析时 db_stats 只有聚合计数，不保留每条查询的 queries 列表
+        """
+        if jobs > 1 and _is_regular_file(filename) and os.path.getsize(filename) >= self._PARALLEL_MIN_SIZE:
+            self._parse_parallel(filename, jobs)
+            return
+
+        # 逐行读取，避免把整个日志一次性读入内存
+        self._parse_lines(_iter_lines(filename))
 
-        with open(filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+    def _parse_lines(self, lines):
+        """逐行解析日志内容，lines 为 bytes，只在保存字段时解码"""
+        current_query = {}
 
         for line in lines:
             line = line.strip()
 
             # 跳过空行
-            if not line or line.startswith('--'):
+            if not line or line.startswith(b'--'):
                 continue
 
-            # 解析时间戳
-            if line.startswith('# Time:'):
-                if current_query:
-                    self._process_query(current_query)
-                current_query = {'timestamp': line[7:].strip()}
-
-            # 解析用户信息
-            elif line.startswith('# User@Host:'):
-                user_host = re.search(r'User@Host:\s+(\w+)\[.*\]\s+@\s+\[(.*?)\]', line)
-                if user_host:
-                    current_query['user'] = user_host.group(1)
-                    current_query['host'] = user_host.group(2)
-
-            # 解析查询时间和扫描行数
-            elif line.startswith('# Query_time:'):
-                stats = re.search(
-                    r'Query_time:\s+([\d.]+)\s+Lock_time:\s+([\d.]+)\s+Rows_sent:\s+(\d+)\s+Rows_examined:\s+(\d+)',
-                    line)
-                if stats:
-                    current_query['query_time'] = float(stats.group(1))
-                    current_query['lock_time'] = float(stats.group(2))
-                    current_query['rows_sent'] = int(stats.group(3))
-                    current_query['rows_examined'] = int(stats.group(4))
+            # 注释行按 "# " 后的 4 个字符直接查表分发到 Time、User@Host、Query_time 的解析函数
+            if line.startswith(b'#'):
+                handler = self._HEADER_DISPATCH.get(line[2:6])
+                if handler is not None:
+                    current_query = handler(self, line, current_query)
+                continue
 
+            # 只对行首几个字符转小写判断，不对整行长 SQL 做 lower()
             # 处理use语句
-            elif line.lower().startswith('use '):
-                self.current_db = line[4:].strip(';').strip('`')
+            if line[:4].lower() == b'use ':
+                self.current_db = line[4:].strip(b';').strip(b'`').decode('utf-8', 'replace')
                 continue
 
             # 处理实际的SQL语句
-            elif not line.startswith('#') and not line.lower().startswith('set timestamp'):
+            elif line[:13].lower() != b'set timestamp':
+                line = line.decode('utf-8', 'replace')
                 if 'sql' not in current_query:
                     current_query['sql'] = line
                     current_query['database'] = self.current_db
@@ -81,24 +156,107 @@ class SlowQueryLogAnalyzer:
         if current_query:
             self._process_query(current_query)
 
+    def _parse_time(self, line, current_query):
+        """解析时间戳，遇到新的 Time 头时处理上一个查询"""
+        if not line.startswith(b'# Time:'):
+            return current_query
+        if current_query:
+            self._process_query(current_query)
+        return {'timestamp': line[7:].strip().decode('utf-8', 'replace')}
+
+    def _parse_user_host(self, line, current_query):
+        """解析用户信息"""
+        user_host = self._USER_HOST_RE.match(line)
+        if user_host:
+            current_query['user'] = user_host.group(1).decode('utf-8', 'replace')
+            current_query['host'] = user_host.group(2).decode('utf-8', 'replace')
+        return current_query
+
+    def _parse_query_time(self, line, current_query):
+        """解析查询时间和扫描行数"""
+        stats = self._QUERY_TIME_RE.match(line)
+        if stats:
+            current_query['query_time'] = float(stats.group(1))
+            current_query['lock_time'] = float(stats.group(2))
+            current_query['rows_sent'] = int(stats.group(3))
+            current_query['rows_examined'] = int(stats.group(4))
+        return current_query
+
+    _HEADER_DISPATCH = {
+        b'Time': _parse_time,
+        b'User': _parse_user_host,
+        b'Quer': _parse_query_time,
+    }
+
+    @staticmethod
+    def _split_chunks(filename, jobs):
+        """把文件按字节大致均分为 jobs 段，每段起点对齐到 # Time: 行"""
+        size = os.path.getsize(filename)
+        bounds = [0]
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(1, jobs):
+                pos = mm.find(b'\n# Time:', max(size * i // jobs - 1, bounds[-1]))
+                if pos < 0:
+                    break
+                bounds.append(pos + 1)
+        bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def _parse_parallel(self, filename, jobs):
+        """多进程解析各段日志，再按文件顺序合并结果"""
+        chunks = self._split_chunks(filename, jobs)
+        with multiprocessing.Pool(min(jobs, len(chunks))) as pool:
+            for result in pool.imap(_parse_chunk, [(filename, start, end) for start, end in chunks]):
+                self._merge_chunk(*result)
+
+    def _merge_chunk(self, sql_stats, sql_dbs, db_stats, last_db):
+        """合并一段日志的解析结果，段首还没遇到 use 的查询沿用上一段最后的数据库"""
+        inherited = self.current_db
+
+        for (_, chunk_sql_key), entry in sql_stats.items():
+            # 子进程的 hash 种子可能不同，SQL 哈希和 str(set) 生成的表键都要在本进程按 SQL 重新计算
+            sql = entry['sql']
+            table_key = str(set(self._extract_tables_cached(sql)))
+            stat_key = (table_key, hash(sql))
+
+            dbs = sql_dbs[chunk_sql_key]
+            if _INHERIT_DB in dbs:
+                dbs.discard(_INHERIT_DB)
+                dbs.add(inherited or 'unknown')
+            self.table_dbs[table_key].update(dbs)
+
+            tmpMap = self.sql_stats.get(stat_key)
+            if tmpMap is None:
+                self.sql_stats[stat_key] = entry
+                continue
+            tmpMap["query_count"] += entry["query_count"]
+            if entry["max_time"] > tmpMap["max_time"]:
+                tmpMap["max_time"] = entry["max_time"]
+            tmpMap["total_time"] += entry["total_time"]
+
+        for db_name, stats in db_stats.items():
+            if db_name == _INHERIT_DB:
+                db_name = inherited
+            self.db_stats[db_name]['query_count'] += stats['query_count']
+            for table, count in stats['tables'].items():
+                self.db_stats[db_name]['tables'][table] += count
+
+        if last_db != _INHERIT_DB:
+            self.current_db = last_db
+
+    @classmethod
+    @functools.lru_cache(maxsize=50000)
+    def _extract_tables_cached(cls, sql):
+        """提取SQL中的表名，慢日志中同一条SQL会重复出现，按SQL缓存结果"""
+        # 先用子串查找过滤掉 SET、COMMIT 等不涉及表的语句
+        sql_lower = sql.lower()
+        if not any(k in sql_lower for k in cls._TABLE_KEYWORDS):
+            return frozenset()
+        return frozenset(cls._TABLE_RE.findall(sql))
+
     def extract_tables(self, sql):
         """提取SQL中的表名"""
-        patterns = [
-            # 匹配 SELECT 中的表名
-            re.compile(r'FROM\s+([^\s,;()]+)', re.IGNORECASE),
-            re.compile(r'JOIN\s+([^\s,;()]+)', re.IGNORECASE),
-            # 匹配 INSERT INTO 中的表名
-            re.compile(r'INSERT\s+INTO\s+([^\s,;()]+)', re.IGNORECASE),
-            # 匹配 UPDATE 中的表名
-            re.compile(r'UPDATE\s+([^\s,;()]+)', re.IGNORECASE),
-        ]
-
-        table_names = set()
-
-        # 遍历所有正则表达式模式，提取匹配的表名
-        for pattern in patterns:
-            tables = re.findall(pattern, sql)
-            table_names.update(tables)
+        table_names = set(self._extract_tables_cached(sql))
         if not table_names:
             print('No tables found', sql)
             # exit(1)
@@ -110,111 +268,151 @@ class SlowQueryLogAnalyzer:
         if 'sql' not in query:
             return
 
+        # SQL 可能很长，只计算一次哈希，后续用它作为字典键
+        query['sql_key'] = hash(query['sql'])
+
         # 提取涉及的表
         tables = self.extract_tables(query['sql'])
         self.generateTableInfo(tables, query)
         query['tables'] = list(tables)
 
-        # 更新数据库统计
+        # 更新数据库统计，只查找一次该库的统计项
         db_name = query.get('database', 'unknown')
-        self.db_stats[db_name]['query_count'] += 1
-        self.db_stats[db_name]['queries'].append(query)
+        db_entry = self.db_stats[db_name]
+        db_entry['query_count'] += 1
+        if self._KEEP_QUERIES:
+            db_entry['queries'].append(query)
 
         # 更新表统计
+        table_counts = db_entry['tables']
         for table in tables:
-            self.db_stats[db_name]['tables'][table] += 1
+            table_counts[table] += 1
 
     def generateTableInfo(self, table_key, query):
         if not table_key:
             return
         table_key = str(table_key)
-        if table_key not in self.tables:
-            self.tables[table_key] = {
-                'db': [],
+        # 日志开头还没有 use 语句时 database 为 None
+        db = query.get('database') or 'unknown'
+        self.table_dbs[table_key].add(db)
+
+        stat_key = (table_key, query['sql_key'])
+        tmpMap = self.sql_stats.get(stat_key)
+        if tmpMap is None:
+            tmpMap = self.sql_stats[stat_key] = {
+                'sql': query.get('sql', 'unknown'),
+                'query_count': 0,
+                'max_time': 0,
+                'total_time': 0,
             }
-        db = query.get('database', 'unknown')
-        if db not in self.tables[table_key]["db"]:
-            self.tables[table_key]["db"].append(db)
-        sql = query.get('sql', 'unknown')
-        tmpMap = {
-            'query_count': 0,
-            'max_time': 0,
-            'total_time': 0,
-            'avg_time': 0,
-        }
-
-        if sql in self.tables[table_key]:
-            tmpMap = self.tables[table_key][sql]
 
+        query_time = query.get("query_time", 0)
         tmpMap["query_count"] += 1
-        if query.get("query_time", 0) > tmpMap["max_time"]:
-            tmpMap["max_time"] = query['query_time']
-        tmpMap["total_time"] += query.get("query_time", 0)
-        tmpMap["avg_time"] = tmpMap["total_time"] / tmpMap["query_count"]
-        self.tables[table_key][sql] = tmpMap
+        if query_time > tmpMap["max_time"]:
+            tmpMap["max_time"] = query_time
+        tmpMap["total_time"] += query_time
 
-    def analyze(self, log_file, output_prefix='slow_query'):
+    def analyze(self, log_file, output_prefix='slow_query', jobs=1):
         """分析日志并生成报告"""
         # 解析日志文件
         print("正在解析日志文件...")
-        self.parse_log_file(log_file)
+        self.parse_log_file(log_file, jobs)
 
-        workbook = xlsxwriter.Workbook(f"{output_prefix}_report.xlsx")
+        # 生成详细报告
+        print("正在生成详细报告...")
+        # 每个表的 db 列只排序、拼接一次，该表的所有 SQL 行共用
+        db_cells = {}
+        for k, dbs in self.table_dbs.items():
+            dbs = sorted(dbs)
+            db_cells[k] = (dbs, ' '.join(dbs), str(dbs)[:50])
+
+        # 一次遍历汇总所有行，排序一次后分别输出 Excel、Markdown、JSON
+        rows = []
+        for (k, _), v1 in self.sql_stats.items():
+            sql = v1["sql"]
+            tmp1 = "-------"
+            if "SQL_NO_CACHE" in sql:
+                tmp1 = "数据库备份导致的"
+            rows.append(_ReportRow(k, v1["query_count"], v1["total_time"], v1["total_time"] / v1["query_count"],
+                                   v1["max_time"], *db_cells[k], sql, tmp1))
+        rows.sort(key=lambda r: (r.count, r.table), reverse=True)
+
+        # constant_memory 模式下每行写完即刷盘，行必须按顺序写入
+        workbook = xlsxwriter.Workbook(f"{output_prefix}_report.xlsx",
+                                       {'constant_memory': True, 'strings_to_urls': False})
         worksheet = workbook.add_worksheet()
         # 写入表头
         headers = ['表', '次数', '平均时间', '最大时间', '处理方式', 'db', 'sql']
-        for col_num, header in enumerate(headers):
-            worksheet.write(0, col_num, header)
-
-
-        # 生成详细报告
-        print("正在生成详细报告...")
-        sort_data = []
-        markdown = """| 表                                                        | 次数 | 平均时间 | 最大时间 | 处理方式                      |db|sql|
-|----------------------------------------------------------|----|------|------|---------------------------|-----|-------|\n"""
-
-        row_num = 0
-        for k, v in self.tables.items():
-            for k1, v1 in v.items():
-                if k1 != "db":
-                    row_num += 1
-                    tmp1 = "-------"
-                    if "SQL_NO_CACHE" in k1:
-                        tmp1 = "数据库备份导致的"
-
-                    tmp_data = [k, v1["query_count"], v1["avg_time"],v1["max_time"],tmp1, v["db"], k1]
-                    for col_num, value in enumerate(tmp_data):
-                        if type(value) == list:
-                            worksheet.write(row_num, col_num, ' '.join(value))
-                        else:
-                            worksheet.write(row_num, col_num, value)
-                    tmp_data = "|{0}|{1}|{2:.2f}|{3:.2f}|{6}|{5}|{4}|\n".format(k, v1["query_count"], v1["avg_time"],
-                                                                                v1["max_time"], k1[:200],
-                                                                                str(v["db"])[:50], tmp1)
-                    sort_data.append([v1["query_count"], k, tmp_data])
-
-
+        worksheet.write_row(0, 0, headers)
+        for row_num, row in enumerate(rows, 1):
+            # 每列类型固定，直接调用对应类型的写入方法，跳过 write 的类型判断
+            worksheet.write_string(row_num, 0, row.table)
+            worksheet.write_number(row_num, 1, row.count)
+            worksheet.write_number(row_num, 2, row.avg_time)
+            worksheet.write_number(row_num, 3, row.max_time)
+            worksheet.write_string(row_num, 4, row.remark)
+            worksheet.write_string(row_num, 5, row.db_cell)
+            worksheet.write_string(row_num, 6, row.sql)
         workbook.close()
         print(f"Excel报告已生成: {output_prefix}_report.xlsx")
 
-        sorted_data = sorted(sort_data, key=lambda x: (x[0], x[1]), reverse=True)
-        for data in sorted_data:
-            markdown += data[2]
         markdownfile = f"{output_prefix}_markdown.md"
+        # 逐行写入文件，不在内存中拼接整个文档
         with open(markdownfile, 'w', encoding='utf-8') as f:
-            f.write(markdown)
+            f.write("""| 表                                                        | 次数 | 平均时间 | 最大时间 | 处理方式                      |db|sql|
+|----------------------------------------------------------|----|------|------|---------------------------|-----|-------|\n""")
+            for row in rows:
+                f.write("|{0}|{1}|{2:.2f}|{3:.2f}|{6}|{5}|{4}|\n".format(row.table, row.count, row.avg_time,
+                                                                          row.max_time, row.sql[:200],
+                                                                          row.db_md, row.remark))
 
 
         report_file = f"{output_prefix}_report_table.json"
-        with open(report_file, 'w', encoding='utf-8') as f:
-            self.tables["tables"] = list(self.tables.keys())
-            json.dump(self.tables, f, indent=2, ensure_ascii=False)
+        # 按表分组输出，SQL 哈希每次运行都会变化，JSON 中仍以 SQL 文本为键
+        report = {}
+        for row in rows:
+            report.setdefault(row.table, {'db': row.db})[row.sql] = {
+                'query_count': row.count,
+                'max_time': row.max_time,
+                'total_time': row.total_time,
+                'avg_time': row.avg_time,
+            }
+        report["tables"] = list(report.keys())
+        if orjson is not None:
+            # orjson 与标准库 json 的浮点数写法不同（如 1e-05 写作 0.00001），两种输出内容一致但字节不同
+            with open(report_file, 'wb') as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        else:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+
+class _ChunkAnalyzer(SlowQueryLogAnalyzer):
+    """子进程中使用的解析器，额外按 SQL 记录涉及的数据库
+
+    表键由 str(set) 生成，顺序依赖 hash 种子，父进程需要按 SQL 重建表键，
+    所以数据库不能按子进程的表键汇总
+    """
+
+    _KEEP_QUERIES = False
+
+    def __init__(self):
+        super().__init__()
+        self.current_db = _INHERIT_DB
+        self.sql_dbs = defaultdict(set)
+
+    def generateTableInfo(self, table_key, query):
+        super().generateTableInfo(table_key, query)
+        if table_key:
+            self.sql_dbs[query['sql_key']].add(query.get('database') or 'unknown')
+
 
 def main():
     parser = argparse.ArgumentParser(description='MySQL慢查询日志分析工具')
     parser.add_argument('-l', '--log_file', default="completion_video_share_slow.log", help='MySQL慢查询日志文件路径')
     parser.add_argument('-o', '--output', default='slow_query',
                         help='输出文件前缀 (默认: slow_query)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='解析日志的进程数 (默认: CPU 核数)')
 
     args = parser.parse_args()
 
@@ -223,7 +421,7 @@ def main():
         return
 
     analyzer = SlowQueryLogAnalyzer()
-    analyzer.analyze(args.log_file, args.output)
+    analyzer.analyze(args.log_file, args.output, args.jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+多进程解析与单进程解析结果一致性检查
+"""
+
+import multiprocessing
+import random
+
+import pytest
+
+pytest.importorskip('xlsxwriter')
+
+import mysql_slowQueryLogAnalyzer as analyzer_mod
+
+
+def _write_log(path):
+    """生成包含多表 JOIN 和 use 切换的慢日志"""
+    rnd = random.Random(0)
+    tables = ['orders', 'users', 'items', 'shops', 'logs', 'pay']
+    sqls = ['SELECT * FROM {0} a JOIN {1} b ON a.id = b.id;'.format(a, b)
+            for a in tables for b in tables if a != b]
+    sqls += ['UPDATE users SET name = 1;', 'commit;']
+    lines = []
+    for i in range(3000):
+        lines.append('# Time: 2024-01-01T10:00:{0:02d}Z\n'.format(i % 60))
+        lines.append('# User@Host: app[app] @  [10.0.0.1]  Id: 1\n')
+        lines.append('# Query_time: {0:.6f}  Lock_time: 0.000100 Rows_sent: 1  Rows_examined: {1}\n'.format(
+            rnd.random() * 5, i))
+        if rnd.random() < 0.02:
+            lines.append('use {0};\n'.format(rnd.choice(['a', 'b', 'c'])))
+        lines.append('SET timestamp={0};\n'.format(i))
+        lines.append(rnd.choice(sqls) + '\n')
+    path.write_text(''.join(lines), encoding='utf-8')
+
+
+def _summary(analyzer):
+    sql_stats = {key: (v['sql'], v['query_count'], round(v['total_time'], 6), v['max_time'])
+                 for key, v in analyzer.sql_stats.items()}
+    table_dbs = {k: sorted(v) for k, v in analyzer.table_dbs.items()}
+    db_stats = {k: (v['query_count'], dict(v['tables'])) for k, v in analyzer.db_stats.items()}
+    return sql_stats, table_dbs, db_stats
+
+
+@pytest.mark.parametrize('start_method', ['fork', 'spawn'])
+def test_parallel_matches_serial(tmp_path, monkeypatch, start_method):
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip(start_method + ' not supported')
+    log_file = tmp_path / 'slow.log'
+    _write_log(log_file)
+
+    serial = analyzer_mod.SlowQueryLogAnalyzer()
+    serial.parse_log_file(str(log_file))
+
+    # spawn 的子进程 hash 种子与父进程不同，用来检查表键、SQL 键的重建
+    monkeypatch.setattr(analyzer_mod.SlowQueryLogAnalyzer, '_PARALLEL_MIN_SIZE', 0)
+    monkeypatch.setattr(analyzer_mod.multiprocessing, 'Pool',
+                        multiprocessing.get_context(start_method).Pool)
+    parallel = analyzer_mod.SlowQueryLogAnalyzer()
+    parallel.parse_log_file(str(log_file), jobs=4)
+
+    assert _summary(parallel) == _summary(serial)